@@ -1,7 +1,35 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import plotly.express as px
 import traceback
+import os
+import tempfile
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+# Above this many cells the heatmap is binned server-side instead of shipping
+# the whole matrix to the browser
+HEATMAP_MAX_CELLS = 5000
+
+# Figure caches are process-wide and shared across sessions, so bound them
+FIG_CACHE_ENTRIES = 32
+FIG_CACHE_TTL = 3600  # seconds
+
+# Copy-on-Write lets boolean-mask slices be extended with new columns without
+# defensive .copy() calls (always on, and no longer configurable, in pandas 3)
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.options.mode.copy_on_write = True
 
 st.set_page_config(
     page_title="Manchester United Analytics Dashboard",
@@ -9,9 +37,20 @@ st.set_page_config(
 )
 
 
-@st.cache_data
-def load_data():
-    df = pd.read_csv("combined_seasons.csv")
+DATA_CSV = "combined_seasons.csv"
+DATA_PARQUET = "combined_seasons.parquet"
+
+REQUIRED_COLS = ["home_team", "away_team", "home_goals", "away_goals", "Season", "Referee"]
+
+
+def read_csv_data():
+    # Arrow's multithreaded C++ parser is much faster than pd.read_csv
+    table = pacsv.read_csv(
+        DATA_CSV,
+        read_options=pacsv.ReadOptions(use_threads=True),
+        convert_options=pacsv.ConvertOptions(strings_can_be_null=True),
+    )
+    df = table.to_pandas()
 
     # --- Make column names robust (handle raw CSV or cleaned CSV) ---
     rename_map = {}
@@ -27,11 +66,264 @@ def load_data():
     if "FTR" in df.columns:
         rename_map["FTR"] = "result"
 
-    df = df.rename(columns=rename_map)
+    return df.rename(columns=rename_map)
+
+
+def convert_csv_to_parquet():
+    # One-off preprocessing: parse the CSV and cache it on disk as Parquet.
+    # Write to a temp file first so a crash or a concurrent server process
+    # never leaves a truncated Parquet file behind.
+    df = read_csv_data()
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(DATA_PARQUET)),
+        prefix="combined_seasons.",
+        suffix=".tmp.parquet",
+    )
+    os.close(fd)
+    try:
+        df.to_parquet(tmp_path, engine="pyarrow", compression="zstd", index=False)
+        os.replace(tmp_path, DATA_PARQUET)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+@st.cache_data
+def load_data():
+    # Without the CSV (Parquet-only deployment) the Parquet file is current
+    parquet_stale = os.path.exists(DATA_CSV) and (
+        not os.path.exists(DATA_PARQUET)
+        or os.path.getmtime(DATA_PARQUET) < os.path.getmtime(DATA_CSV)
+    )
+    df = None
+    if parquet_stale:
+        try:
+            convert_csv_to_parquet()
+        except OSError:
+            # Read-only deployment: skip the on-disk cache
+            df = read_csv_data()
+            df = df[[c for c in REQUIRED_COLS if c in df.columns]]
+
+    if df is None:
+        # Only read the columns the dashboard uses (missing ones are reported in main)
+        available = pq.read_schema(DATA_PARQUET).names
+        columns = [c for c in REQUIRED_COLS if c in available]
+        df = pd.read_parquet(DATA_PARQUET, engine="pyarrow", columns=columns)
+
+    # Referee / Season are aggregation and filter keys -> categorical codes
+    for c in ("Referee", "Season"):
+        if c in df.columns:
+            df[c] = df[c].astype("category")
+
+    # Team names are only compared to "Man United" -> Arrow string kernels
+    for c in ("home_team", "away_team"):
+        if c in df.columns:
+            df[c] = df[c].astype("string[pyarrow]")
+
+    # Goal counts fit in int8 (signed, so MU goal differences can't wrap)
+    for c in ("home_goals", "away_goals"):
+        if c in df.columns:
+            df[c] = pd.to_numeric(df[c], downcast="integer")
 
     return df
 
 
+@st.cache_data
+def build_mu_matches():
+    # No DataFrame argument: Streamlit would hash it on every rerun, which
+    # costs more than the vectorized derivation itself
+    df = load_data()
+
+    # Filter MU matches only
+    # Arrow-backed == runs in C++, not per-element Python comparisons
+    is_mu_match = (
+        (df["home_team"] == "Man United") | (df["away_team"] == "Man United")
+    ).to_numpy(dtype=bool, na_value=False)
+
+    mu_matches = df.loc[is_mu_match]
+
+    # Determine MU result W/D/L from MU's point of view
+    is_home = (mu_matches["home_team"] == "Man United").to_numpy(
+        dtype=bool, na_value=False
+    )
+    hg = mu_matches["home_goals"].to_numpy()
+    ag = mu_matches["away_goals"].to_numpy()
+    mu_gf = np.where(is_home, hg, ag)
+    mu_ga = np.where(is_home, ag, hg)
+    diff = mu_gf - mu_ga
+
+    mu_matches["mu_result"] = np.where(
+        diff > 0, "W", np.where(diff < 0, "L", "D")
+    )
+    mu_matches["goal_diff"] = diff
+    mu_matches["is_win"] = (diff > 0).astype(np.int8)
+
+    return mu_matches
+
+
+# No DataFrame arguments, for the same reason as build_mu_matches()
+@st.cache_data
+def season_options():
+    return sorted(load_data()["Season"].dropna().unique().tolist())
+
+
+@st.cache_data
+def referee_options():
+    return sorted(build_mu_matches()["Referee"].dropna().unique().tolist())
+
+
+if numba is not None:
+
+    # Serial on purpose: Streamlit runs the script in worker threads, where
+    # Numba's default (workqueue) parallel backend is not safe to use.
+    @numba.njit(cache=True)
+    def agg_win_matrix(rc, sc, w, nr, ns):
+        sums = np.zeros((nr, ns), np.float64)
+        cnts = np.zeros((nr, ns), np.int64)
+        for i in range(rc.size):
+            r = rc[i]
+            s = sc[i]
+            if r >= 0 and s >= 0:  # code -1 = missing referee/season
+                sums[r, s] += w[i]
+                cnts[r, s] += 1
+        return sums, cnts
+
+
+@st.cache_data
+def precompute_win_matrices():
+    # Wins / matches per (Referee, Season) in one pass over category codes
+    # (Polars' multithreaded group_by, else the Numba kernel, else np.bincount)
+    mu_matches = build_mu_matches()
+    ref = mu_matches["Referee"].cat
+    season = mu_matches["Season"].cat
+    rc = ref.codes.to_numpy().astype(np.int64)
+    sc = season.codes.to_numpy().astype(np.int64)
+    is_win = mu_matches["is_win"].to_numpy()
+
+    nr, ns = len(ref.categories), len(season.categories)
+    if pl is not None:
+        agg = (
+            pl.DataFrame({"rc": rc, "sc": sc, "is_win": is_win})
+            .filter((pl.col("rc") >= 0) & (pl.col("sc") >= 0))
+            .group_by(["rc", "sc"])
+            .agg(pl.col("is_win").sum().alias("wins"), pl.len().alias("n"))
+        )
+        key = agg["rc"].to_numpy() * ns + agg["sc"].to_numpy()
+        wins = np.zeros(nr * ns, np.int64)
+        counts = np.zeros(nr * ns, np.int64)
+        wins[key] = agg["wins"].to_numpy()
+        counts[key] = agg["n"].to_numpy()
+    elif numba is not None:
+        wins, counts = agg_win_matrix(rc, sc, is_win.astype(np.float64), nr, ns)
+    else:
+        valid = (rc >= 0) & (sc >= 0)  # code -1 = missing referee/season
+        key = rc[valid] * ns + sc[valid]
+        wins = np.bincount(key, weights=is_win[valid], minlength=nr * ns)
+        counts = np.bincount(key, minlength=nr * ns)
+
+    wins = pd.DataFrame(
+        wins.astype(np.int64).reshape(nr, ns),
+        index=pd.Index(ref.categories, name="Referee"),
+        columns=pd.Index(season.categories, name="Season"),
+    )
+    counts = pd.DataFrame(counts.reshape(nr, ns), index=wins.index, columns=wins.columns)
+
+    # Keep only referees / seasons that actually appear in MU matches
+    rows = counts.sum(axis=1).to_numpy() > 0
+    cols = counts.sum(axis=0).to_numpy() > 0
+    return wins.loc[rows, cols], counts.loc[rows, cols]
+
+
+# -----------------------
+# FIGURES (cached per filter selection; data args are not hashed)
+# -----------------------
+@st.cache_resource(max_entries=FIG_CACHE_ENTRIES, ttl=FIG_CACHE_TTL)
+def make_fig_win_rate(filter_key, _win_rate_ref):
+    # float32 ndarrays are sent to the browser as binary typed arrays
+    win_pct = _win_rate_ref.to_numpy(np.float32)
+    return px.bar(
+        x=win_pct,
+        y=_win_rate_ref.index.to_numpy(),
+        orientation="h",
+        color=win_pct,
+        color_continuous_scale="reds",
+        labels={"x": "Win %", "y": "Referee"},
+        title="MU Win % by Referee",
+    )
+
+
+@st.cache_resource(max_entries=FIG_CACHE_ENTRIES, ttl=FIG_CACHE_TTL)
+def make_fig_goal_diff(filter_key, _gd_ref):
+    gd = _gd_ref.to_numpy(np.float32)
+    return px.bar(
+        x=gd,
+        y=_gd_ref.index.to_numpy(),
+        orientation="h",
+        color=gd,
+        color_continuous_scale="RdBu",
+        labels={"x": "Goal Difference", "y": "Referee"},
+        title="Goal Difference by Referee",
+    )
+
+
+@st.cache_resource(max_entries=FIG_CACHE_ENTRIES, ttl=FIG_CACHE_TTL)
+def make_fig_heatmap(filter_key, _heatmap_data):
+    return px.imshow(
+        _heatmap_data.to_numpy(dtype=np.float32),
+        x=_heatmap_data.columns.tolist(),
+        y=_heatmap_data.index.tolist(),
+        color_continuous_scale="Blues",
+        text_auto=".1f",
+        labels={"x": "Season", "y": "Referee", "color": "Win %"},
+        title="MU Win % by Referee per Season",
+    )
+
+
+def bin_starts(n, n_bins):
+    # Start index of each of n_bins contiguous, non-empty blocks over range(n)
+    return np.arange(n_bins) * n // n_bins
+
+
+def bin_labels(labels, starts):
+    # Name each bin after the first / last label of the block it sums
+    labels = [str(x) for x in labels]
+    ends = np.append(starts[1:], len(labels)) - 1
+    return [
+        labels[lo] if lo == hi else f"{labels[lo]} – {labels[hi]}"
+        for lo, hi in zip(starts, ends)
+    ]
+
+
+@st.cache_resource(max_entries=FIG_CACHE_ENTRIES, ttl=FIG_CACHE_TTL)
+def make_fig_heatmap_binned(filter_key, _wins, _counts):
+    # Sum wins and matches over blocks of referees / seasons, then divide, so
+    # the browser gets at most ~HEATMAP_MAX_CELLS cells and empty cells don't
+    # drag a bin's win % towards 0
+    nr, nc = _counts.shape
+    width = min(nc, 60)
+    height = min(nr, max(1, HEATMAP_MAX_CELLS // width))
+    row_starts = bin_starts(nr, height)
+    col_starts = bin_starts(nc, width)
+
+    def block_sum(m):
+        m = np.add.reduceat(m.to_numpy(dtype=np.int64), row_starts, axis=0)
+        return np.add.reduceat(m, col_starts, axis=1)
+
+    wins = block_sum(_wins)
+    counts = block_sum(_counts)
+    win_pct = np.full(counts.shape, np.nan, dtype=np.float32)
+    np.divide(wins * 100, counts, out=win_pct, where=counts > 0, casting="unsafe")
+
+    return px.imshow(
+        win_pct,
+        x=bin_labels(_counts.columns, col_starts),
+        y=bin_labels(_counts.index, row_starts),
+        color_continuous_scale="Blues",
+        labels={"x": "Season", "y": "Referee", "color": "Win %"},
+        title="MU Win % by Referee per Season (binned)",
+    )
+
+
 def main():
     st.title("⚽ Manchester United Analytics Dashboard (Interactive)")
 
@@ -44,153 +336,114 @@ def main():
             st.write("Columns:", list(df.columns))
 
         # Required columns
-        required_cols = ["home_team", "away_team", "home_goals", "away_goals", "Season", "Referee"]
-        missing = [c for c in required_cols if c not in df.columns]
+        missing = [c for c in REQUIRED_COLS if c not in df.columns]
         if missing:
             st.error(f"Missing columns in CSV: {missing}")
             st.stop()
 
-        # -----------------------
-        # Filter MU matches only
-        # -----------------------
-        df["is_mu_match"] = df.apply(
-            lambda row: (
-                row["home_team"] == "Man United" or row["away_team"] == "Man United"
-            ),
-            axis=1,
-        )
-
-        mu_matches = df[df["is_mu_match"]].copy()
-
-        # Determine MU result W/D/L
-        def mu_result(row):
-            if row["home_team"] == "Man United":
-                if row["home_goals"] > row["away_goals"]:
-                    return "W"
-                elif row["home_goals"] < row["away_goals"]:
-                    return "L"
-                else:
-                    return "D"
-            else:
-                if row["away_goals"] > row["home_goals"]:
-                    return "W"
-                elif row["away_goals"] < row["home_goals"]:
-                    return "L"
-                else:
-                    return "D"
-
-        mu_matches["mu_result"] = mu_matches.apply(mu_result, axis=1)
+        mu_matches = build_mu_matches()
 
         # -----------------------
         # SIDEBAR FILTERS
         # -----------------------
         st.sidebar.title("Filters")
 
+        all_seasons = season_options()
         seasons = st.sidebar.multiselect(
             "Select Season(s):",
-            sorted(df["Season"].unique()),
-            default=sorted(df["Season"].unique()),
+            all_seasons,
+            default=all_seasons,
         )
 
+        all_referees = referee_options()
         referees = st.sidebar.multiselect(
             "Select Referee(s):",
-            sorted(mu_matches["Referee"].unique()),
-            default=sorted(mu_matches["Referee"].unique()),
+            all_referees,
+            default=all_referees,
         )
 
-        filtered = mu_matches[
-            (mu_matches["Season"].isin(seasons))
-            & (mu_matches["Referee"].isin(referees))
-        ].copy()
+        # Map selected labels to category codes once, then filter on int codes
+        ref = mu_matches["Referee"].cat
+        season = mu_matches["Season"].cat
+        sel_ref_codes = np.flatnonzero(ref.categories.isin(referees))
+        sel_season_codes = np.flatnonzero(season.categories.isin(seasons))
+        mask_ref = np.isin(ref.codes.to_numpy(), sel_ref_codes)
+        mask_season = np.isin(season.codes.to_numpy(), sel_season_codes)
+
+        filtered = mu_matches.loc[mask_ref & mask_season]
 
         if filtered.empty:
             st.warning("No matches for current filter selection.")
             return
 
+        # Figures only depend on the selection (not its order), so they are
+        # cached on it
+        filter_key = (tuple(sorted(seasons)), tuple(sorted(referees)))
+
         # -----------------------
         # MATCH COUNT & METRICS
         # -----------------------
-        filtered["match_count"] = filtered["Referee"].map(
-            filtered["Referee"].value_counts()
-        )
+        # Slice the precomputed (Referee, Season) matrices to the selection
+        wins_all, counts_all = precompute_win_matrices()
+        rows = wins_all.index[wins_all.index.isin(referees)]
+        cols = wins_all.columns[wins_all.columns.isin(seasons)]
+        counts = counts_all.loc[rows, cols]
+        rows = rows[counts.sum(axis=1).to_numpy() > 0]
+        cols = cols[counts.sum(axis=0).to_numpy() > 0]
+        wins = wins_all.loc[rows, cols]
+        counts = counts_all.loc[rows, cols]
+
+        # Heatmap data
+        heatmap_data = (wins / counts.replace(0, np.nan)).mul(100).fillna(0)
 
-        # Win rate per referee
+        # Win rate per referee (weighted by matches, not a mean of seasons)
         win_rate_ref = (
-            filtered.groupby("Referee")["mu_result"]
-            .apply(lambda x: (x == "W").mean() * 100)
+            (wins.sum(axis=1) / counts.sum(axis=1))
+            .mul(100)
             .sort_values(ascending=False)
         )
 
         # Goal difference per referee
-        filtered["goal_diff"] = filtered.apply(
-            lambda row: (row["home_goals"] - row["away_goals"])
-            if row["home_team"] == "Man United"
-            else (row["away_goals"] - row["home_goals"]),
-            axis=1,
-        )
-
         gd_ref = (
-            filtered.groupby("Referee")["goal_diff"]
+            filtered.groupby("Referee", observed=True, sort=False)["goal_diff"]
             .mean()
             .sort_values(ascending=False)
         )
 
-        # Heatmap data
-        heatmap_data = (
-            filtered.groupby(["Referee", "Season"])["mu_result"]
-            .apply(lambda x: (x == "W").mean() * 100)
-            .unstack(fill_value=0)
-        )
-
         # ======================================
         # LAYOUT (Season Trend Chart Removed)
         # ======================================
 
         # Win % by Referee
         st.subheader("🔵 Win % by Referee (Interactive Bar Chart)")
-        fig1 = px.bar(
-            win_rate_ref,
-            x=win_rate_ref.values,
-            y=win_rate_ref.index,
-            orientation="h",
-            color=win_rate_ref.values,
-            color_continuous_scale="reds",
-            labels={"x": "Win %", "y": "Referee"},
-            title="MU Win % by Referee",
-        )
+        fig1 = make_fig_win_rate(filter_key, win_rate_ref)
         st.plotly_chart(fig1, use_container_width=True)
 
         # Goal Difference by Referee
         st.subheader("🔴 Average Goal Difference by Referee")
-        fig2 = px.bar(
-            gd_ref,
-            x=gd_ref.values,
-            y=gd_ref.index,
-            orientation="h",
-            color=gd_ref.values,
-            color_continuous_scale="RdBu",
-            labels={"x": "Goal Difference", "y": "Referee"},
-            title="Goal Difference by Referee",
-        )
+        fig2 = make_fig_goal_diff(filter_key, gd_ref)
         st.plotly_chart(fig2, use_container_width=True)
 
         # Heatmap
         st.subheader("🟣 Win % Heatmap (Referee × Season)")
-        fig4 = px.imshow(
-            heatmap_data,
-            color_continuous_scale="Blues",
-            text_auto=".1f",
-            labels={"x": "Season", "y": "Referee", "color": "Win %"},
-            title="MU Win % by Referee per Season",
-        )
-        st.plotly_chart(fig4, use_container_width=True)
+        if heatmap_data.size > HEATMAP_MAX_CELLS:
+            fig4 = make_fig_heatmap_binned(filter_key, wins, counts)
+            st.plotly_chart(fig4, use_container_width=True)
+            st.caption(
+                f"{heatmap_data.shape[0]} referees × {heatmap_data.shape[1]} seasons, "
+                "grouped into bins; hover a cell for the referees/seasons it covers."
+            )
+        else:
+            fig4 = make_fig_heatmap(filter_key, heatmap_data)
+            st.plotly_chart(fig4, use_container_width=True)
 
         # Match Count Table
         st.subheader("📊 Referee Match Counts (Filtered)")
         st.dataframe(
-            filtered.groupby("Referee")["match_count"]
-            .first()
+            filtered.groupby("Referee", observed=True, sort=False)
+            .size()
             .sort_values(ascending=False)
+            .rename("match_count")
         )
 
     except Exception as e: